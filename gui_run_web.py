@@ -9,54 +9,75 @@ import subprocess
 import webbrowser
 import time
 import threading
+import socket
+import hashlib
+import functools
+import importlib.util
+import urllib.request
+import http.client
 from pathlib import Path
 
 # Add current directory to path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Import existing VoxNovel functionality
-try:
-    import download_missing_booknlp_models
-    print("✓ BookNLP modules initialized")
-except ImportError as e:
-    print(f"⚠ Warning: Could not import BookNLP modules: {e}")
+from web_logging import logger
 
 # Import the web server
 try:
     from web_server import app
     WEB_SERVER_AVAILABLE = True
-    print("✓ Web server module available")
+    logger.debug("✓ Web server module available")
 except ImportError as e:
-    print(f"⚠ Warning: Could not import web server: {e}")
-    print("  Make sure web_server.py and Flask are installed")
+    logger.warning("⚠ Warning: Could not import web server: %s", e)
+    logger.warning("  Make sure web_server.py and Flask are installed")
     WEB_SERVER_AVAILABLE = False
 
+ENV_STAMP_FILE = Path('.voxnovel_env_ok')
+
 def check_dependencies():
     """Check if all required dependencies are available"""
-    print("Checking dependencies...")
+    logger.info("Checking dependencies...")
 
     # Check for required Python packages
     required_packages = ['flask', 'werkzeug']
+    if os.name != 'nt':
+        # gunicorn only runs on Unix; Windows falls back to the Flask server
+        required_packages += ['gunicorn', 'gevent']
+
+    # Skip the import probes if this package list was already verified for this
+    # interpreter; changing either one changes the key and forces a recheck
+    env_key = hashlib.sha256(repr((required_packages, sys.version, sys.prefix)).encode()).hexdigest()
+    try:
+        if ENV_STAMP_FILE.read_text() == env_key:
+            logger.info("✓ Dependencies already verified")
+            return True
+    except OSError:
+        pass
+
     missing_packages = []
 
     for package in required_packages:
         try:
             __import__(package)
-            print(f"✓ {package} installed")
+            logger.debug("✓ %s installed", package)
         except ImportError:
             missing_packages.append(package)
-            print(f"✗ {package} missing")
+            logger.warning("✗ %s missing", package)
 
     if missing_packages:
-        print(f"\nInstalling missing packages: {', '.join(missing_packages)}")
+        logger.info("Installing missing packages: %s", ', '.join(missing_packages))
         try:
             subprocess.check_call([sys.executable, '-m', 'pip', 'install'] + missing_packages)
-            print("✓ Dependencies installed successfully")
-            return True
+            logger.info("✓ Dependencies installed successfully")
         except subprocess.CalledProcessError:
-            print("✗ Failed to install dependencies")
+            logger.error("✗ Failed to install dependencies")
             return False
 
+    try:
+        ENV_STAMP_FILE.write_text(env_key)
+    except OSError:
+        pass  # Not fatal, the probes just run again next time
+
     return True
 
 def setup_directories():
@@ -73,35 +94,51 @@ def setup_directories():
         'web_interface/templates'
     ]
 
-    for directory in directories:
+    # makedirs creates parents, so nested entries cover their parent entries
+    leaf_directories = [d for d in directories if not any(other.startswith(d + '/') for other in directories)]
+    for directory in leaf_directories:
         os.makedirs(directory, exist_ok=True)
-        print(f"✓ Directory ready: {directory}")
+    logger.info("✓ %d directories ready", len(directories))
 
 def initialize_models():
     """Initialize BookNLP and TTS models"""
-    print("Initializing AI models...")
+    logger.info("Initializing AI models...")
 
     try:
-        # This will download and initialize BookNLP models
-        if 'download_missing_booknlp_models' in sys.modules:
-            print("✓ BookNLP models checked")
+        # BookNLP models are downloaded by the web server when the first book is processed
+        if importlib.util.find_spec('download_missing_booknlp_models') is not None:
+            logger.debug("✓ BookNLP models will be checked on first use")
 
-        # Test basic TTS import
-        try:
-            from TTS.api import TTS
-            print("✓ TTS library available")
-        except ImportError:
-            print("⚠ TTS library not available - will install later")
+        # Check for TTS without importing it, importing pulls in torch
+        if importlib.util.find_spec('TTS') is not None:
+            logger.debug("✓ TTS library available")
+        else:
+            logger.warning("⚠ TTS library not available - will install later")
 
         return True
     except Exception as e:
-        print(f"⚠ Model initialization warning: {e}")
+        logger.warning("⚠ Model initialization warning: %s", e)
         return True  # Continue even if models aren't fully ready
 
+def gunicorn_available():
+    """Check if the server can be run under gunicorn with gevent workers"""
+    if os.name == 'nt':
+        return False
+    return all(importlib.util.find_spec(module) is not None for module in ('gunicorn', 'gevent'))
+
+@functools.lru_cache(maxsize=1)
 def get_local_ip():
     """Get the local IP address for the server"""
+    # Resolving our own hostname avoids touching the network when it's configured properly
+    try:
+        ip = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)[0][4][0]
+        if not ip.startswith('127.'):
+            return ip
+    except (socket.gaierror, IndexError):
+        pass
+
+    # Fall back to asking the OS which interface routes to the internet
     try:
-        import socket
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
@@ -111,23 +148,31 @@ def get_local_ip():
         return "127.0.0.1"
 
 def open_browser_delayed(url):
-    """Open browser after a short delay to ensure server is running"""
-    time.sleep(2)
+    """Open browser once the server answers its health check"""
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=0.2):
+                break
+        except (OSError, http.client.HTTPException):
+            # Connection refused or a half-started server while it boots
+            time.sleep(0.05)
+
     try:
         webbrowser.open(url)
-        print(f"✓ Browser opened to {url}")
+        logger.info("✓ Browser opened to %s", url)
     except:
-        print(f"⚠ Could not open browser automatically")
-        print(f"  Please manually navigate to: {url}")
+        logger.warning("⚠ Could not open browser automatically")
+        logger.warning("  Please manually navigate to: %s", url)
 
 def main():
     """Main function to run the web GUI"""
-    print("🎭 VoxNovel Web Interface Starting...")
-    print("=" * 50)
+    logger.info("🎭 VoxNovel Web Interface Starting...")
+    logger.info("=" * 50)
 
     # Check dependencies
     if not check_dependencies():
-        print("❌ Failed to install dependencies")
+        logger.error("❌ Failed to install dependencies")
         return 1
 
     # Setup directories
@@ -135,35 +180,48 @@ def main():
 
     # Initialize models
     if not initialize_models():
-        print("❌ Failed to initialize models")
+        logger.error("❌ Failed to initialize models")
         return 1
 
     # Check if web server is available
     if not WEB_SERVER_AVAILABLE:
-        print("❌ Web server not available")
-        print("  Please ensure web_server.py exists and Flask is installed")
+        logger.error("❌ Web server not available")
+        logger.error("  Please ensure web_server.py exists and Flask is installed")
         return 1
 
     # Get local IP and port
     local_ip = get_local_ip()
     port = 8080
 
-    print("\n" + "=" * 50)
-    print("🚀 Starting VoxNovel Web Server...")
-    print(f"📡 Local access: http://127.0.0.1:{port}")
-    print(f"📡 Network access: http://{local_ip}:{port}")
-    print("=" * 50)
+    logger.info("=" * 50)
+    logger.info("🚀 Starting VoxNovel Web Server...")
+    logger.info("📡 Local access: http://127.0.0.1:%d", port)
+    logger.info("📡 Network access: http://%s:%d", local_ip, port)
+    logger.info("=" * 50)
 
-    # Open browser in a separate thread after delay
-    browser_thread = threading.Thread(
-        target=open_browser_delayed,
-        args=(f"http://127.0.0.1:{port}",),
-        daemon=True
-    )
-    browser_thread.start()
+    # Open browser once the server is up, the short delay gives it a head start
+    browser_timer = threading.Timer(0.2, open_browser_delayed, args=(f"http://127.0.0.1:{port}",))
+    browser_timer.daemon = True
+    browser_timer.start()
 
     try:
-        # Run the Flask web server
+        if gunicorn_available():
+            # Run under gunicorn with a gevent worker so status polls and uploads
+            # don't block each other. A single worker keeps job state in one process,
+            # and timeout 0 stops gunicorn killing the worker during long jobs.
+            server = subprocess.Popen([
+                sys.executable, '-m', 'gunicorn',
+                '-k', 'gevent',
+                '-w', '1',
+                '--worker-connections', '1000',
+                '--timeout', '0',
+                '-b', f'0.0.0.0:{port}',
+                '--chdir', os.path.dirname(os.path.abspath(__file__)),
+                'web_server:app'
+            ])
+            return server.wait()
+
+        # Fall back to the Flask web server
         app.run(
             host='0.0.0.0',  # Listen on all interfaces
             port=port,
@@ -171,10 +229,10 @@ def main():
             threaded=True    # Handle multiple requests
         )
     except KeyboardInterrupt:
-        print("\n👋 VoxNovel Web Server stopped by user")
+        logger.info("👋 VoxNovel Web Server stopped by user")
         return 0
     except Exception as e:
-        print(f"\n❌ Error running web server: {e}")
+        logger.error("❌ Error running web server: %s", e)
         return 1
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Shared job state for the VoxNovel web server - guarded by a lock so the background
+job thread and the request handlers never see a half-updated status
+"""
+
+import threading
+
+_lock = threading.Lock()
+
+_current_job = None
+_version = 0  # Bumped on every status update, used as the /status ETag
+_state = {
+    'status': 'idle',
+    'progress': 0,
+    'message': 'Ready to process books',
+    'start_time': None,
+    'output_file': None
+}
+
+def get_status_snapshot():
+    """Return a copy of the current job status"""
+    with _lock:
+        return dict(_state)
+
+def get_versioned_status():
+    """Return the status version and a copy of the current job status"""
+    with _lock:
+        return _version, dict(_state)
+
+def update_status(**kwargs):
+    """Update one or more job status fields"""
+    global _version
+    with _lock:
+        _state.update(kwargs)
+        _version += 1
+
+def get_current_job():
+    """Return the path of the book being processed, or None"""
+    with _lock:
+        return _current_job
+
+def try_start_job(path):
+    """Claim the job slot for path, returns False if another job is running"""
+    global _current_job
+    with _lock:
+        if _current_job is not None:
+            return False
+        _current_job = path
+        return True
+
+def finish_job(path):
+    """Release the job slot if it is still held by path"""
+    global _current_job
+    with _lock:
+        if _current_job == path:
+            _current_job = None
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+Console logger for the VoxNovel web GUI and web server
+"""
+
+import sys
+import logging
+
+# Plain message format keeps console output looking like it did with print
+logger = logging.getLogger('voxnovel')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
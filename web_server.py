@@ -8,66 +8,136 @@ import sys
 import json
 import threading
 import time
+import uuid
+import functools
+import shutil
+import importlib.util
 from datetime import datetime
-from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from urllib.parse import unquote
+from flask import Flask, Request, render_template, request, jsonify, send_file, redirect, url_for, abort
 from werkzeug.utils import secure_filename
 import zipfile
 import tempfile
+from web_logging import logger
+from shared import get_status_snapshot, get_versioned_status, update_status, get_current_job, try_start_job, finish_job
 
 # Add VoxNovel modules to path
 sys.path.append('/app')
 
+class UploadRequest(Request):
+    """Request that keeps multipart uploads in memory up to UPLOAD_SPOOL_SIZE instead of Werkzeug's 500KB"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_SIZE'], mode='rb+')
+
 # Initialize Flask app
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+app.request_class = UploadRequest
+app.config['MULTIPART_MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size for /upload
+app.config['UPLOAD_CHUNK_SIZE'] = 1024 * 1024  # 1MB chunks when writing uploads to disk
+app.config['UPLOAD_SPOOL_SIZE'] = 64 * 1024 * 1024  # Multipart uploads up to 64MB stay in memory
 app.config['UPLOAD_FOLDER'] = '/app/uploads'
 app.config['OUTPUT_FOLDER'] = '/app/output_audiobooks'
+# Let a fronting server with X-Sendfile support (Apache mod_xsendfile, lighttpd) send downloads itself
+app.config['USE_X_SENDFILE'] = os.environ.get('VOXNOVEL_USE_X_SENDFILE') == '1'
+
+# Distinguishes /status ETags from a previous server run, whose version counter started at the same place
+STATUS_ETAG_PREFIX = uuid.uuid4().hex[:8]
 
 # Ensure directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-# Global variables for job tracking
-current_job = None
-job_status = {
-    'status': 'idle',
-    'progress': 0,
-    'message': 'Ready to process books',
-    'start_time': None,
-    'output_file': None
-}
-
-# Import VoxNovel modules
-try:
-    import download_missing_booknlp_models
-    from headless_voxnovel import process_book_headless
-    VOXNOVEL_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: VoxNovel modules not available: {e}")
-    VOXNOVEL_AVAILABLE = False
+# VoxNovel modules pull in BookNLP and torch, so they are imported on first use.
+# None means they haven't been loaded yet.
+VOXNOVEL_AVAILABLE = None
+process_book_headless = None
+
+def load_voxnovel_modules():
+    """Import VoxNovel modules on first use, returns True if they are available"""
+    global VOXNOVEL_AVAILABLE, process_book_headless
+
+    if VOXNOVEL_AVAILABLE is None:
+        try:
+            import download_missing_booknlp_models
+            from headless_voxnovel import process_book_headless
+            VOXNOVEL_AVAILABLE = True
+        except Exception as e:
+            # Importing these runs module-level code (model downloads, prompts), not just imports
+            logger.warning("Warning: VoxNovel modules not available: %s", e)
+            VOXNOVEL_AVAILABLE = False
+
+    return VOXNOVEL_AVAILABLE
+
+def voxnovel_modules_found():
+    """Report whether the VoxNovel modules are installed, without importing them before first use"""
+    if VOXNOVEL_AVAILABLE is not None:
+        return VOXNOVEL_AVAILABLE
+    return all(importlib.util.find_spec(module) is not None
+               for module in ('download_missing_booknlp_models', 'headless_voxnovel'))
+
+ALLOWED_EXTENSIONS = frozenset(('.epub', '.pdf', '.mobi', '.txt', '.html', '.rtf', '.fb2', '.odt', '.cbr', '.cbz'))
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    ALLOWED_EXTENSIONS = {'epub', 'pdf', 'mobi', 'txt', 'html', 'rtf', 'fb2', 'odt', 'cbr', 'cbz'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS
+
+# Re-uploads of the same book skip the sanitising regex passes
+cached_secure_filename = functools.lru_cache(maxsize=512)(secure_filename)
+
+def upload_filename(original):
+    """Sanitise an uploaded book's name, generating one if sanitising strips the extension"""
+    filename = cached_secure_filename(original)
+    extension = os.path.splitext(original)[1].lower()
+    # Non-ASCII titles such as "Война.epub" sanitise down to just "epub"
+    if os.path.splitext(filename)[1].lower() != extension:
+        filename = f"upload-{uuid.uuid4().hex}{extension}"
+    return filename
+
+def get_processing_options(values):
+    """Read processing options from form or query string values, raises ValueError on bad input"""
+    try:
+        silence_duration = int(values.get('silence_duration', 500))
+    except ValueError:
+        raise ValueError('Silence duration must be a whole number of milliseconds')
+
+    return {
+        'tts_model': values.get('tts_model', 'xtts_v2'),
+        'use_gpu': values.get('use_gpu', 'true').lower() == 'true',
+        'chapter_delimiter': values.get('chapter_delimiter', 'Chapter'),
+        'silence_duration': silence_duration
+    }
+
+def start_book_job(filepath, options):
+    """Start processing in background thread"""
+    thread = threading.Thread(target=process_book_job, args=(filepath, options))
+    thread.daemon = True
+    thread.start()
+
+@app.before_request
+def limit_multipart_upload():
+    """Only the multipart upload route is gated by the upload size limit"""
+    if request.endpoint == 'upload_file':
+        # Chunked bodies have no length to check up front, so they can't be bounded here
+        if request.content_length is None:
+            abort(411)
+        if request.content_length > app.config['MULTIPART_MAX_CONTENT_LENGTH']:
+            abort(413)
 
 @app.route('/')
 def index():
     """Main page"""
-    return render_template('index.html', job_status=job_status)
+    return render_template('index.html', job_status=get_status_snapshot())
 
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'voxnovel_available': VOXNOVEL_AVAILABLE})
+    return jsonify({'status': 'healthy', 'voxnovel_available': voxnovel_modules_found()})
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handle file upload"""
-    global current_job
-
-    if current_job:
+    """Handle multipart file upload (fallback for clients that can't send a raw body)"""
+    if get_current_job():
         return jsonify({'error': 'Another job is already running'}), 400
 
     if 'file' not in request.files:
@@ -78,102 +148,164 @@ def upload_file():
         return jsonify({'error': 'No file selected'}), 400
 
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        try:
+            options = get_processing_options(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Get processing options
-        options = {
-            'tts_model': request.form.get('tts_model', 'xtts_v2'),
-            'use_gpu': request.form.get('use_gpu', 'true').lower() == 'true',
-            'chapter_delimiter': request.form.get('chapter_delimiter', 'Chapter'),
-            'silence_duration': int(request.form.get('silence_duration', 500))
-        }
+        filename = upload_filename(file.filename)
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if not try_start_job(filepath):
+            return jsonify({'error': 'Another job is already running'}), 400
 
-        # Start processing in background thread
-        thread = threading.Thread(target=process_book_job, args=(filepath, options))
-        thread.daemon = True
-        thread.start()
+        try:
+            # FileStorage.save copies in 16KB pieces, use the larger upload chunk size
+            with open(filepath, 'wb') as out:
+                shutil.copyfileobj(file.stream, out, length=app.config['UPLOAD_CHUNK_SIZE'])
+            start_book_job(filepath, options)
+        except Exception as e:
+            # Don't leave a truncated book behind if the write fails
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            finish_job(filepath)
+            return jsonify({'error': f'Upload failed: {str(e)}'}), 400
 
         return jsonify({'message': 'File uploaded and processing started', 'filename': filename})
 
     return jsonify({'error': 'File type not allowed'}), 400
 
+@app.route('/upload_raw', methods=['POST', 'PUT'])
+def upload_file_raw():
+    """Handle raw-body file upload, streamed straight to disk without multipart parsing"""
+    if get_current_job():
+        return jsonify({'error': 'Another job is already running'}), 400
+
+    original_filename = unquote(request.headers.get('X-Filename', ''))
+    if original_filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    if not allowed_file(original_filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+
+    try:
+        options = get_processing_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = upload_filename(original_filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not try_start_job(filepath):
+        return jsonify({'error': 'Another job is already running'}), 400
+
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    try:
+        with open(filepath, 'wb', buffering=chunk_size) as f:
+            while chunk := request.stream.read(chunk_size):
+                f.write(chunk)
+        start_book_job(filepath, options)
+    except Exception as e:
+        # Don't leave a truncated book behind if the client disconnects
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        finish_job(filepath)
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 400
+
+    return jsonify({'message': 'File uploaded and processing started', 'filename': filename})
+
 @app.route('/status')
 def get_status():
-    """Get current job status"""
-    return jsonify(job_status)
+    """Get current job status, answers 304 if it hasn't changed since the client's last poll"""
+    version, status = get_versioned_status()
+    etag = f'{STATUS_ETAG_PREFIX}-{version}'
+    not_modified = request.if_none_match.contains(etag)
+
+    # A 304 must carry the same ETag and Cache-Control headers as the 200
+    response = app.response_class(status=304) if not_modified else jsonify(status)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # Browsers must revalidate every poll
+    return response
 
 @app.route('/download/<filename>')
 def download_file(filename):
     """Download generated audiobook"""
     filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
     if os.path.exists(filepath):
-        return send_file(filepath, as_attachment=True)
+        # Pass the path rather than an open file so the WSGI server's file_wrapper
+        # (gunicorn) can hand the audiobook to sendfile(2) instead of copying it.
+        # conditional enables Range requests so players can seek and resume.
+        return send_file(filepath, as_attachment=True, conditional=True, etag=True)
     return jsonify({'error': 'File not found'}), 404
 
 @app.route('/jobs')
 def list_jobs():
     """List completed jobs"""
     jobs = []
-    output_dir = Path(app.config['OUTPUT_FOLDER'])
 
-    for file_path in output_dir.glob('*.m4b'):
-        stat = file_path.stat()
-        jobs.append({
-            'filename': file_path.name,
-            'size': stat.st_size,
-            'created': datetime.fromtimestamp(stat.st_ctime).strftime('%Y-%m-%d %H:%M:%S')
-        })
+    # scandir reuses the directory listing for is_file() and caches stat() per entry
+    with os.scandir(app.config['OUTPUT_FOLDER']) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.m4b') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            jobs.append({
+                'filename': entry.name,
+                'size': stat.st_size,
+                'created': datetime.fromtimestamp(stat.st_ctime).strftime('%Y-%m-%d %H:%M:%S')
+            })
 
     return render_template('jobs.html', jobs=jobs)
 
+def simulate_book_processing(report_progress):
+    """Stand-in for the VoxNovel pipeline, returns False if the job was cancelled"""
+    # Under gunicorn's gevent worker time.sleep is monkey-patched to yield to other requests
+
+    # Simulate BookNLP processing
+    for i in range(10, 50, 5):
+        time.sleep(2)  # Simulate processing time
+        if not report_progress(i, f'Processing book text... {i}%'):
+            return False
+
+    # Simulate TTS processing
+    for i in range(50, 90, 5):
+        time.sleep(3)  # Simulate processing time
+        if not report_progress(i, f'Generating audio... {i}%'):
+            return False
+
+    return True
+
 def process_book_job(filepath, options):
-    """Process book in background thread"""
-    global current_job, job_status
-
-    if not VOXNOVEL_AVAILABLE:
-        job_status.update({
-            'status': 'error',
-            'message': 'VoxNovel modules not available',
-            'progress': 0
-        })
-        return
-
-    current_job = filepath
+    """Process book in background thread, the job slot for filepath is already claimed"""
     filename = os.path.basename(filepath)
 
-    job_status.update({
-        'status': 'processing',
-        'progress': 10,
-        'message': 'Starting book processing...',
-        'start_time': datetime.now().isoformat(),
-        'output_file': None
-    })
+    def report_progress(progress, message):
+        """Progress callback for the processing steps, returns False once the job is cancelled"""
+        if get_current_job() != filepath:
+            return False
+        update_status(progress=progress, message=message)
+        return True
 
     try:
-        # This is a simplified version - you'd need to adapt the actual VoxNovel processing
-        # For now, we'll simulate processing with progress updates
-
-        # Simulate BookNLP processing
-        for i in range(10, 50, 5):
-            if current_job != filepath:  # Job was cancelled
-                return
-            time.sleep(2)  # Simulate processing time
-            job_status.update({
-                'progress': i,
-                'message': f'Processing book text... {i}%'
-            })
+        if not load_voxnovel_modules():
+            update_status(
+                status='error',
+                message='VoxNovel modules not available',
+                progress=0
+            )
+            return
+
+        logger.info("Processing book: %s", filename)
+        update_status(
+            status='processing',
+            progress=10,
+            message='Starting book processing...',
+            start_time=datetime.now().isoformat(),
+            output_file=None
+        )
 
-        # Simulate TTS processing
-        for i in range(50, 90, 5):
-            if current_job != filepath:
-                return
-            time.sleep(3)  # Simulate processing time
-            job_status.update({
-                'progress': i,
-                'message': f'Generating audio... {i}%'
-            })
+        # This is a simplified version - you'd need to adapt the actual VoxNovel processing
+        # and have it call report_progress as it goes
+        if not simulate_book_processing(report_progress):
+            return  # Job was cancelled
 
         # Simulate final processing
         time.sleep(2)
@@ -185,32 +317,33 @@ def process_book_job(filepath, options):
         with open(output_path, 'w') as f:
             f.write("This would be the generated audiobook file")
 
-        job_status.update({
-            'status': 'completed',
-            'progress': 100,
-            'message': f'Audiobook generated successfully: {output_filename}',
-            'output_file': output_filename
-        })
+        logger.info("Audiobook generated: %s", output_filename)
+        update_status(
+            status='completed',
+            progress=100,
+            message=f'Audiobook generated successfully: {output_filename}',
+            output_file=output_filename
+        )
 
     except Exception as e:
-        job_status.update({
-            'status': 'error',
-            'message': f'Processing failed: {str(e)}',
-            'progress': 0
-        })
+        logger.exception("Processing failed for %s", filename)
+        update_status(
+            status='error',
+            message=f'Processing failed: {str(e)}',
+            progress=0
+        )
 
     finally:
-        current_job = None
+        finish_job(filepath)
 
 if __name__ == '__main__':
     # Initialize BookNLP models if available
-    if VOXNOVEL_AVAILABLE:
-        try:
-            print("Initializing BookNLP models...")
-            download_missing_booknlp_models
-            print("Models initialized successfully")
-        except Exception as e:
-            print(f"Warning: Could not initialize models: {e}")
+    try:
+        logger.info("Initializing BookNLP models...")
+        if load_voxnovel_modules():
+            logger.info("Models initialized successfully")
+    except Exception as e:
+        logger.warning("Warning: Could not initialize models: %s", e)
 
     # Start web server
     app.run(host='0.0.0.0', port=8080, debug=False)
\ No newline at end of file